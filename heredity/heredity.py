@@ -1,5 +1,8 @@
+import concurrent.futures
 import csv
 import itertools
+import operator
+import os
 import sys
 
 PROBS = {                                                                       # dictionary containing a number of constants representing probabilities of various different events. 
@@ -37,6 +40,17 @@ PROBS = {
                                                                                 # Conversely, if a mother has no versions of the gene, and therefore does not pass it onto her child, there’s a 1% chance it mutates into being the target gene
 }
 
+# The same numbers as flat tuples, so loops over people can index them by gene count instead of looking them up by key
+GENE_PRIOR = tuple(PROBS["gene"][genes] for genes in range(3))                  # GENE_PRIOR[genes]
+PASSING = (PROBS["mutation"], 0.5, 1 - PROBS["mutation"])                       # PASSING[parent genes] = chance that parent passes the gene on
+TRAIT_TABLE = tuple(                                                            # TRAIT_TABLE[genes * 2 + trait], trait as 0 or 1
+    PROBS["trait"][genes][trait] for genes in range(3) for trait in (False, True)
+)
+
+# Pedigrees with at least this many people are enumerated on every CPU core; smaller ones finish before worker processes would start up
+PARALLEL_PEOPLE = 10
+SHARES_PER_WORKER = 8                                                           # The work is split into about this many shares per core.
+
 
 def main():
 
@@ -45,45 +59,8 @@ def main():
         sys.exit("Usage: python heredity.py data.csv")
     people = load_data(sys.argv[1])                                             # loads data from a file into a dictionary people.
 
-    # Keep track of gene and trait probabilities for each person
-    probabilities = {                                                           # defines a dictionary of probabilities
-        person: {
-            "gene": {
-                2: 0,
-                1: 0,
-                0: 0
-            },
-            "trait": {
-                True: 0,
-                False: 0
-            }
-        }
-        for person in people
-    }
-
-    # Loop over all sets of people who might have the trait
-    names = set(people)
-    for have_trait in powerset(names):                                          # Who might have the trait (powerset(names)).
-
-        # Check if current set of people violates known information
-        fails_evidence = any(
-            (people[person]["trait"] is not None and
-             people[person]["trait"] != (person in have_trait))
-            for person in names
-        )
-        if fails_evidence:
-            continue
-
-        # Loop over all sets of people who might have the gene
-        for one_gene in powerset(names):                                        # Who might have 1 gene.
-            for two_genes in powerset(names - one_gene):                        # Who might have 2 genes.
-
-                # Update probabilities with new joint probability
-                p = joint_probability(people, one_gene, two_genes, have_trait)  # For each scenario → compute joint probability → update the distributions.
-                update(probabilities, one_gene, two_genes, have_trait, p)
-
-    # Ensure probabilities sum to 1
-    normalize(probabilities)
+    # Compute gene and trait distributions for each person
+    probabilities = infer(people)                                               # Exact marginals via variable elimination (see infer below).
 
     # Print results
     for person in people:
@@ -95,6 +72,78 @@ def main():
                 print(f"    {value}: {p:.4f}")
 
 
+def enumerate_probabilities(people):
+    """
+    Compute each person's gene and trait distributions by enumeration.
+    Sums the joint probability over every assignment of genes, with unknown
+    traits summed out in closed form, so the work grows as 3^N; `infer`
+    gives the same answer much faster.
+    """
+    pedigree = index_people(people)
+    names = pedigree["names"]
+    if hasattr(os, "sched_getaffinity"):                                        # Only the cores this process may run on, not every core in the machine.
+        workers = len(os.sched_getaffinity(0))
+    else:
+        workers = os.cpu_count() or 1
+    if len(names) < PARALLEL_PEOPLE or workers == 1:
+        gene_sums, trait_sums = enumerate_share(pedigree, 0, 1)
+    else:                                                                       # Share k takes one = k, k + step, k + 2 * step, ...
+        step = SHARES_PER_WORKER * workers + 1                                  # An odd step mixes masks with few and many bits set into every share
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:       # (an even one would fix the lowest bit), and the extra shares let
+            shares = list(executor.map(                                         # workers that finish early pick up more.
+                enumerate_share,
+                itertools.repeat(pedigree, step),
+                range(step),
+                itertools.repeat(step, step)
+            ))
+        gene_sums, trait_sums = shares[0]
+        for more_genes, more_traits in shares[1:]:                              # Add the other shares' sums into the first one's.
+            for sums, more in zip(gene_sums + trait_sums, more_genes + more_traits):
+                for value, p in enumerate(more):
+                    sums[value] += p
+
+    # Ensure probabilities sum to 1
+    probabilities = dict()
+    for name, gene_sum, trait_sum in zip(names, gene_sums, trait_sums):
+        gene_total = sum(gene_sum)
+        trait_total = sum(trait_sum)
+        probabilities[name] = {
+            "gene": {genes: gene_sum[genes] / gene_total for genes in (2, 1, 0)},
+            "trait": {trait: trait_sum[trait] / trait_total for trait in (True, False)}
+        }
+    return probabilities
+
+
+def enumerate_share(pedigree, start, step):
+    """
+    Return the unnormalized `gene_sums` and `trait_sums` lists (indexed by
+    position in `pedigree`, see `index_people`) for the gene assignments
+    whose set of people with 1 gene is in range(start, 2^N, step).
+    """
+    positions = range(len(pedigree["names"]))
+    everyone = (1 << len(positions)) - 1                                        # Sets of people are bitmasks: bit i set → person i is in the set.
+
+    # Keep track of gene and trait probabilities for each person
+    gene_sums = [[0.0] * 3 for i in positions]                                  # gene_sums[i][genes]
+    trait_sums = [[0.0] * 2 for i in positions]                                 # trait_sums[i][trait], trait 0 or 1
+    accumulate = compile_accumulate(pedigree, gene_sums, trait_sums)
+
+    # Loop over all sets of people who might have the gene
+    for one in range(start, everyone + 1, step):                                # Who might have 1 gene.
+        rest = everyone & ~one                                                  # Who could still have 2 genes.
+        two = rest
+        while True:                                                             # Who might have 2 genes: every subset of rest, from rest down to 0.
+
+            # Update probabilities with new joint probability
+            accumulate(one, two)
+
+            if two == 0:
+                break
+            two = (two - 1) & rest                                              # Next smaller subset: clear the lowest set bit, refill the bits below it.
+
+    return gene_sums, trait_sums
+
+
 def load_data(filename):
     """
     Load gene and trait data from a file into a dictionary.
@@ -104,29 +153,78 @@ def load_data(filename):
     """
     data = dict()
     with open(filename) as f:                                                   # Returns a dictionary like: {
-        reader = csv.DictReader(f)                                              # "Harry": {"mother": "Lily", "father": "James", "trait": True},
-        for row in reader:                                                      # "James": {"mother": None, "father": None, "trait": False},
-            name = row["name"]                                                  # "Lily": {"mother": None, "father": None, "trait": True}
-            data[name] = {                                                      # }
+        reader = csv.reader(f)                                                  # "Harry": {"mother": "Lily", "father": "James", "trait": True},
+        header = next(reader, None)                                             # "James": {"mother": None, "father": None, "trait": False},
+        if header is None:                                                      # "Lily": {"mother": None, "father": None, "trait": True}
+            return data                                                         # }
+        columns = operator.itemgetter(*(header.index(field) for field in ("name", "mother", "father", "trait")))
+        for row in reader:                                                      # Plain lists, unpacked by position: no dict built per row.
+            if not row:                                                         # Blank line → skip it, as DictReader did.
+                continue
+            row += [""] * (len(header) - len(row))                              # Short row → missing trailing fields are blank.
+            name, mother, father, trait = columns(row)
+            data[name] = {
                 "name": name,
-                "mother": row["mother"] or None,
-                "father": row["father"] or None,
-                "trait": (True if row["trait"] == "1" else
-                          False if row["trait"] == "0" else None)
+                "mother": mother or None,
+                "father": father or None,
+                "trait": (True if trait == "1" else
+                          False if trait == "0" else None)
             }
     return data
 
 
+def index_people(people):
+    """
+    Return the people in `people` as parallel lists indexed by position:
+    their names, the positions of their mother and father (-1 if they have
+    no parents listed), their trait (None if unknown), and the table of
+    their factor in the probability of the evidence (see `factor_table`).
+    """
+    names = list(people)
+    position = {name: i for i, name in enumerate(names)}
+    mothers = [position.get(people[name]["mother"], -1) for name in names]
+    fathers = [position.get(people[name]["father"], -1) for name in names]
+    inheritance = inheritance_table()
+    return {
+        "names": names,
+        "mother": mothers,
+        "father": fathers,
+        "trait": [people[name]["trait"] for name in names],
+        "factor": [factor_table(people, name, inheritance) for name in names]
+    }
+
+
+def factor_table(people, person, inheritance):
+    """
+    Return the table of `person_factor` as nested tuples indexed
+    [genes][mother genes][father genes], for lookups by position.
+    For someone with no parents listed the parents' genes are ignored.
+    """
+    scope, table = person_factor(people, person, inheritance)
+    return tuple(
+        tuple(
+            tuple(
+                table[(genes,) if len(scope) == 1 else (genes, mother, father)]
+                for father in range(3)
+            )
+            for mother in range(3)
+        )
+        for genes in range(3)
+    )
+
+
 def powerset(s):                                                                # Used for testing all combinations of who might have 1 gene, 2 genes, or the trait.
     """
-    Return a list of all possible subsets of set s.
+    Return an iterator over all possible subsets of set s, as frozensets.
+    Each subset is built as the iterator reaches it, instead of all of them
+    up front in a list.
     """
-    s = list(s)
-    return [
-        set(s) for s in itertools.chain.from_iterable(
+    s = tuple(s)
+    return (
+        frozenset(subset) for subset in itertools.chain.from_iterable(
             itertools.combinations(s, r) for r in range(len(s) + 1)
         )
-    ]
+    )
 
 
 def joint_probability(people, one_gene, two_genes, have_trait):
@@ -142,40 +240,77 @@ def joint_probability(people, one_gene, two_genes, have_trait):
     """
     probability = float(1)
 
-    for person in people:
+    for person, info in people.items():
         genes = (                                                               # Figure out how many genes they have (0, 1, or 2).
             2 if person in two_genes else
             1 if person in one_gene else
             0
         )
-
-        trait = person in have_trait
-        mother = people[person]["mother"]
-        father = people[person]["father"]
+        mother = info["mother"]
+        father = info["father"]
 
         if mother is None and father is None:                                   # If they have no parents listed → use unconditional probability from PROBS["gene"].
-            probability *= PROBS["gene"][genes]
+            probability *= GENE_PRIOR[genes]
 
         else:                                                                   # If they have parents → compute probability of inheriting gene from mom/dad:
-            passing = {mother: 0, father: 0}
-
-            for parent in passing:
-                passing[parent] = (
-                    1 - PROBS["mutation"] if parent in two_genes else           # Parent with 2 genes → passes gene with prob 0.99.
-                    0.5 if parent in one_gene else                              # Parent with 1 gene → passes with prob 0.5.
-                    PROBS["mutation"]                                           # Parent with 0 genes → passes with prob 0.01 (mutation).
-                )
+            pm = PASSING[2 if mother in two_genes else 1 if mother in one_gene else 0]  # Parent with 2 genes → passes gene with prob 0.99,
+            pf = PASSING[2 if father in two_genes else 1 if father in one_gene else 0]  # 1 gene → 0.5, 0 genes → 0.01 (mutation).
 
             probability *= (                                                    # Then combine mother + father to get child’s gene probability.
-                passing[mother] * passing[father] if genes == 2 else
-                passing[mother] * (1 - passing[father]) + (1 - passing[mother]) * passing[father] if genes == 1 else
-                (1 - passing[mother]) * (1 - passing[father])
+                pm * pf if genes == 2 else
+                pm * (1 - pf) + (1 - pm) * pf if genes == 1 else
+                (1 - pm) * (1 - pf)
             )
-        probability *= PROBS["trait"][genes][trait]                             # Multiply by probability of trait given that gene count: PROBS["trait"][genes][trait].
+        probability *= TRAIT_TABLE[genes * 2 + (person in have_trait)]          # Multiply by probability of trait given that gene count: PROBS["trait"][genes][trait].
 
     return probability
 
 
+def compile_accumulate(pedigree, gene_sums, trait_sums):
+    """
+    Return a function `accumulate(one, two)` for enumerating `pedigree`
+    (see `index_people`), where `one` and `two` are bitmasks of who has 1
+    and 2 genes. It computes the probability of that assignment together
+    with everyone's known trait, and adds it to `gene_sums[i][genes]` and
+    `trait_sums[i][trait]` for every person i; an unknown trait has the
+    probability split between True and False by PROBS["trait"].
+
+    The function is generated for this pedigree, so that each assignment is
+    handled in one pass of straight-line code: one line per person to read
+    their genes, one lookup per person with their parents already filled
+    in, and one line per person to add the result in.
+    """
+    names = {"TRAIT_TABLE": TRAIT_TABLE}
+    lines = ["def accumulate(one, two):"]
+    terms = []
+    for i, (table, mother, father) in enumerate(zip(pedigree["factor"], pedigree["mother"], pedigree["father"])):
+        lines.append(f"    g{i} = (one >> {i} & 1) | (two >> {i} & 1) << 1")
+        if mother < 0:                                                          # No parents listed → the parents' axes are ignored anyway.
+            names[f"f{i}"] = tuple(table[genes][0][0] for genes in range(3))
+            terms.append(f"f{i}[g{i}]")
+        else:
+            names[f"f{i}"] = table
+            terms.append(f"f{i}[g{i}][g{mother}][g{father}]")
+    lines.append("    p = " + (" * ".join(terms) or "1.0"))                     # Already summed over every choice of the unknown traits.
+
+    for i, trait in enumerate(pedigree["trait"]):
+        names[f"s{i}"], names[f"t{i}"] = gene_sums[i], trait_sums[i]
+        lines.append(f"    s{i}[g{i}] += p")
+        if trait is None:                                                       # Of the assignments summed into p, this share has the trait.
+            lines.append(f"    t{i}[0] += p * TRAIT_TABLE[g{i} * 2]")
+            lines.append(f"    t{i}[1] += p * TRAIT_TABLE[g{i} * 2 + 1]")
+        else:
+            lines.append(f"    t{i}[{int(trait)}] += p")
+
+    exec(compile("\n".join(lines), "<accumulate>", "exec"), names)              # e.g. def accumulate(one, two):
+    return names["accumulate"]                                                  #          g0 = (one >> 0 & 1) | (two >> 0 & 1) << 1
+                                                                                #          ...
+                                                                                #          p = f0[g0][g1][g2] * f1[g1] * f2[g2]
+                                                                                #          s0[g0] += p
+                                                                                #          t0[0] += p * TRAIT_TABLE[g0 * 2]
+                                                                                #          ...
+
+
 def update(probabilities, one_gene, two_genes, have_trait, p):
     """
     Add to `probabilities` a new joint probability `p`.
@@ -214,5 +349,198 @@ def normalize(probabilities):
         probabilities[person]["trait"][False] /= trait_sum
 
 
+def inheritance_table():
+    """
+    Return the probability that a child has each number of genes,
+    keyed by (child genes, mother genes, father genes).
+    """
+    table = dict()
+    for mother, father in itertools.product(range(3), repeat=2):
+        pm, pf = PASSING[mother], PASSING[father]
+        table[2, mother, father] = pm * pf
+        table[1, mother, father] = pm * (1 - pf) + (1 - pm) * pf
+        table[0, mother, father] = (1 - pm) * (1 - pf)
+    return table
+
+
+def person_factor(people, person, inheritance):
+    """
+    Return the factor contributed by `person` as a (scope, table) pair.
+    The scope is the person alone if they have no parents listed, otherwise
+    the person followed by their mother and father; the table maps each
+    assignment of gene counts over the scope to a probability. A known
+    trait is folded in as evidence, an unknown one simply sums out to 1.
+    """
+    mother = people[person]["mother"]
+    father = people[person]["father"]
+    trait = people[person]["trait"]
+
+    def evidence(genes):
+        return 1 if trait is None else TRAIT_TABLE[genes * 2 + trait]
+
+    if mother is None and father is None:
+        return (person,), {
+            (genes,): GENE_PRIOR[genes] * evidence(genes)
+            for genes in range(3)
+        }
+    return (person, mother, father), {
+        key: p * evidence(key[0])
+        for key, p in inheritance.items()
+    }
+
+
+def multiply(factors):
+    """
+    Return the pointwise product of a list of factors.
+    """
+    scope = []
+    for variables, _ in factors:
+        scope.extend(v for v in variables if v not in scope)
+
+    positions = [
+        (tuple(scope.index(v) for v in variables), table)
+        for variables, table in factors
+    ]
+    table = dict()
+    for assignment in itertools.product(range(3), repeat=len(scope)):
+        p = float(1)
+        for index, values in positions:
+            p *= values[tuple(assignment[i] for i in index)]
+        table[assignment] = p
+    return tuple(scope), table
+
+
+def sum_out(variable, factor):
+    """
+    Return `factor` with `variable` summed out of its scope.
+    """
+    scope, table = factor
+    i = scope.index(variable)
+    result = dict()
+    for assignment, p in table.items():
+        key = assignment[:i] + assignment[i + 1:]
+        result[key] = result.get(key, 0) + p
+    return scope[:i] + scope[i + 1:], result
+
+
+def rescale(factor):
+    """
+    Return `factor` divided by its largest entry.
+    Constant factors cancel when the final distribution is normalized, so
+    this changes nothing but keeps long products of small probabilities
+    from underflowing to 0 on large pedigrees.
+    """
+    scope, table = factor
+    largest = max(table.values())
+    if largest == 0:
+        return factor
+    return scope, {assignment: p / largest for assignment, p in table.items()}
+
+
+def project(factor, scope):
+    """
+    Return `factor` with every variable not in `scope` summed out.
+    """
+    for variable in factor[0]:
+        if variable not in scope:
+            factor = sum_out(variable, factor)
+    return factor
+
+
+def elimination_order(factors, order):
+    """
+    Return an order in which to sum the variables out of `factors`.
+    Eliminating a variable creates a factor over its neighbours (everyone
+    sharing a factor with it), so the variable with the fewest neighbours
+    is picked each time, and its neighbours become each other's neighbours.
+    Ties follow `order`.
+    """
+    neighbours = {variable: set() for variable in order}
+    for scope, _ in factors:
+        for variable in scope:
+            neighbours[variable].update(v for v in scope if v != variable)
+
+    remaining = list(order)
+    result = []
+    while remaining:
+        variable = min(remaining, key=lambda v: len(neighbours[v]))
+        remaining.remove(variable)
+        result.append(variable)
+        around = neighbours.pop(variable)
+        for v in around:
+            neighbours[v].discard(variable)
+            neighbours[v].update(u for u in around if u != v)
+    return result
+
+
+def propagate(factors, order):
+    """
+    Return the unnormalized gene distribution of every variable in
+    `factors`, as a dictionary of lists indexed by gene count.
+
+    The upward pass sums the variables out in `order`: each variable's
+    bucket takes the factors and messages still mentioning it, and sends
+    their sum over it on to the bucket of the next variable left in scope.
+    The downward pass sends each bucket back what the rest of the pedigree
+    says about that scope, after which every bucket holds everything it
+    needs for its own variable's marginal. Two passes in total, rather than
+    one full elimination per person.
+    """
+    pending = [(factor, None) for factor in factors]                            # (factor, bucket that sent it); None for a person's own factor.
+    own, children, up = dict(), dict(), dict()
+    for variable in order:                                                      # Upward pass.
+        bucket = [(factor, source) for factor, source in pending if variable in factor[0]]
+        pending = [(factor, source) for factor, source in pending if variable not in factor[0]]
+        own[variable] = [factor for factor, source in bucket if source is None]
+        children[variable] = [source for _, source in bucket if source is not None]
+        incoming = own[variable] + [up[child] for child in children[variable]]
+        up[variable] = rescale(sum_out(variable, multiply(incoming)))
+        pending.append((up[variable], variable))
+
+    down = dict()
+    marginals = dict()
+    for variable in reversed(order):                                            # Downward pass.
+        incoming = own[variable] + ([down[variable]] if variable in down else [])
+        for child in children[variable]:
+            others = incoming + [up[c] for c in children[variable] if c != child]
+            down[child] = rescale(project(multiply(others), up[child][0]))
+        belief = multiply(incoming + [up[child] for child in children[variable]])
+        _, table = project(belief, (variable,))
+        marginals[variable] = [table[genes,] for genes in range(3)]
+    return marginals
+
+
+def infer(people):
+    """
+    Compute each person's gene and trait distributions by variable elimination.
+    Every person contributes one factor over their own gene count (and their
+    parents'), and the marginal for each person is found by summing everyone
+    else out of the product of those factors. This gives the same result as
+    `enumerate_probabilities`, but the work grows with the largest factor
+    built along the way instead of with every possible assignment.
+    """
+    inheritance = inheritance_table()                                           # Same 3x3x3 table for every child, built once.
+    factors = [person_factor(people, person, inheritance) for person in people]
+    order = elimination_order(factors, list(people))                            # Plan the elimination once for the whole pedigree.
+    marginals = propagate(factors, order)
+
+    probabilities = dict()
+    for person in people:
+        marginal = marginals[person]
+        total = sum(marginal)
+        gene = {genes: marginal[genes] / total for genes in (2, 1, 0)}
+
+        trait = people[person]["trait"]
+        if trait is None:                                                       # Unknown trait → average PROBS["trait"] over the gene distribution.
+            p = sum(gene[genes] * PROBS["trait"][genes][True] for genes in gene)
+        else:                                                                   # Known trait → it is certain.
+            p = float(trait)
+        probabilities[person] = {
+            "gene": gene,
+            "trait": {True: p, False: 1 - p}
+        }
+    return probabilities
+
+
 if __name__ == "__main__":
     main()